@@ -0,0 +1,280 @@
+import json
+import os
+import platform
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from evaluator import BatchEvaluator
+from krpsim import MainWalk, RecipeBook, Simulation
+from krpsim_verif import Verification
+from strategies import STRATEGIES
+from tools import ProcessInitializer
+
+
+class ConfigGenerator:
+    @staticmethod
+    def generate(process_count, depth=4, fan_in=2, max_delay=10, cycles=0.0, raw_count=10, seed=0):
+        rng = Random(seed)
+        item_count = max(1, process_count // 2)
+        depth = max(1, min(depth, item_count))
+        layers = [[f'raw_{index}' for index in range(raw_count)]] + [[] for _ in range(depth)]
+        for item in range(item_count):
+            layers[1 + item * depth // item_count].append(f'item_{item}')
+        layer_of = {name: layer for layer, names in enumerate(layers) for name in names}
+        lines = [f'{name}:{rng.randint(100, 1000)}' for name in layers[0]]
+
+        for index in range(process_count):
+            produced = f'item_{index % item_count}'
+            layer = layer_of[produced]
+            inputs = [rng.choice(layers[layer - 1]) for _ in range(fan_in)]
+            if layer < depth and rng.random() < cycles:
+                inputs.append(rng.choice(layers[rng.randint(layer + 1, depth)]))
+            need = ';'.join(f'{name}:{rng.randint(1, 3)}' for name in dict.fromkeys(inputs))
+            lines.append(f'process_{index}:({need}):({produced}:{rng.randint(1, 3)}):{rng.randint(1, max_delay)}')
+
+        lines.append(f'optimize:(time;{layers[depth][-1]})')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def load(config):
+        stock, process_list = dict(), dict()
+        optimization_target = ProcessInitializer.read_process_file(StringIO(config), stock, process_list)
+        resources = ProcessInitializer.intern_resources(stock, process_list)
+        return resources.vector(stock), process_list, resources.ids[optimization_target]
+
+
+class ScanningWalk(MainWalk):
+    def list_possible_processes(self, required_element, process_list):
+        possible_process_list = list()
+        for process in process_list.values():
+            if any(element == required_element for element, _ in process.result_ids):
+                possible_process_list.append(process)
+        return possible_process_list
+
+
+class TimedWalk(MainWalk):
+    finalize_time = 0.0
+
+    def finalize_process(self, max_cycle, base=None):
+        start = perf_counter()
+        good_instructions = super().finalize_process(max_cycle, base)
+        TimedWalk.finalize_time += perf_counter() - start
+        return good_instructions
+
+
+class Benchmark:
+    @staticmethod
+    def time_walks(walk_class, stock, process_list, optimization_target, generations, max_instructions, producers=None,
+                   recipe_book=None):
+        walks = []
+        start = perf_counter()
+        for index in range(generations):
+            walks.append(walk_class(stock, optimization_target, process_list, 0, max_instructions,
+                                    Random(f'0:{index}'), producers, recipe_book))
+        return perf_counter() - start, walks
+
+    @staticmethod
+    def producer_index(process_counts, generations, max_instructions):
+        print(f'{"processes":>10} {"scan (s)":>10} {"index (s)":>10} {"speedup":>8}')
+        for process_count in process_counts:
+            stock, process_list, optimization_target = ConfigGenerator.load(ConfigGenerator.generate(process_count))
+            producers = ProcessInitializer.build_producer_index(process_list)
+            scan_time, scan_walks = Benchmark.time_walks(ScanningWalk, stock, process_list, optimization_target,
+                                                         generations, max_instructions)
+            index_time, index_walks = Benchmark.time_walks(MainWalk, stock, process_list, optimization_target,
+                                                           generations, max_instructions, producers)
+            if any(scan.instruction_dict != index.instruction_dict for scan, index in zip(scan_walks, index_walks)):
+                print(f'Error: walks differ for {process_count} processes')
+            print(f'{process_count:>10} {scan_time:>10.3f} {index_time:>10.3f} {scan_time / index_time:>7.1f}x')
+
+    @staticmethod
+    def recipes(process_counts, generations, max_instructions, recipe_cache):
+        print(f'{"processes":>10} {"walks/s":>10} {"recipes/s":>10} {"hit rate":>9}')
+        for process_count in process_counts:
+            stock, process_list, optimization_target = ConfigGenerator.load(ConfigGenerator.generate(process_count))
+            producers = ProcessInitializer.build_producer_index(process_list)
+            recipe_book = RecipeBook(stock, producers, recipe_cache)
+            walk_time, _ = Benchmark.time_walks(MainWalk, stock, process_list, optimization_target,
+                                                generations, max_instructions, producers)
+            recipe_time, _ = Benchmark.time_walks(MainWalk, stock, process_list, optimization_target,
+                                                  generations, max_instructions, producers, recipe_book)
+            print(f'{process_count:>10} {generations / walk_time:>10.0f} {generations / recipe_time:>10.0f} '
+                  f'{recipe_book.hit_rate():>9.1%}')
+
+    @staticmethod
+    def batch_evaluation(process_counts, generations, max_cycle, max_instructions, batch_size, cycles=0.0):
+        if not BatchEvaluator.available():
+            print('Error: NumPy is not installed')
+            return
+        print(f'{"processes":>10} {"scalar/s":>10} {"batch/s":>10} {"speedup":>8}')
+        for process_count in process_counts:
+            stock, process_list, optimization_target = ConfigGenerator.load(
+                ConfigGenerator.generate(process_count, cycles=cycles))
+            producers = ProcessInitializer.build_producer_index(process_list)
+            instruction_dicts = [MainWalk(stock, optimization_target, process_list, max_cycle, max_instructions,
+                                          Random(f'0:{index}'), producers, evaluate=False).instruction_dict
+                                 for index in range(generations)]
+            start = perf_counter()
+            scalar_ranks = [MainWalk(stock, optimization_target, process_list, max_cycle, max_instructions,
+                                     None, producers, instruction_dict=instruction_dict).rank()
+                            for instruction_dict in instruction_dicts]
+            scalar_time = perf_counter() - start
+            evaluator = BatchEvaluator(stock, process_list, optimization_target, max_cycle)
+            start = perf_counter()
+            batch_ranks = []
+            for first in range(0, generations, batch_size):
+                batch_ranks.extend(evaluator.ranks(instruction_dicts[first:first + batch_size]))
+            batch_time = perf_counter() - start
+            if scalar_ranks != batch_ranks:
+                print(f'Error: ranks differ for {process_count} processes')
+            print(f'{process_count:>10} {generations / scalar_time:>10.0f} {generations / batch_time:>10.0f} '
+                  f'{scalar_time / batch_time:>7.1f}x')
+
+
+    @staticmethod
+    def measure(config, generations, max_cycle, max_instructions, directory):
+        simulation = Simulation(time())
+        start = perf_counter()
+        simulation.load_model(StringIO(config))
+        parse_time = perf_counter() - start
+
+        simulation.max_cycle = max_cycle
+        simulation.max_delay = float('inf')
+        simulation.output = os.path.join(directory, 'trace.csv')
+        TimedWalk.finalize_time = 0.0
+        best_walk = None
+        start = perf_counter()
+        for index in range(generations):
+            new_main_walk = TimedWalk(simulation.stock_vector, simulation.target_id, simulation.process_list,
+                                      max_cycle, max_instructions, Random(f'0:{index}'), simulation.producers)
+            if best_walk is None or new_main_walk.rank() > best_walk.rank():
+                best_walk = new_main_walk
+        generation_time = perf_counter() - start
+
+        start = perf_counter()
+        with redirect_stdout(StringIO()):
+            simulation.display_result(best_walk)
+        display_time = perf_counter() - start
+
+        verifier = Verification(StringIO(config), simulation.output)
+        start = perf_counter()
+        try:
+            with redirect_stdout(StringIO()):
+                verifier.execute()
+            verified = True
+        except SystemExit:
+            verified = False
+        verify_time = perf_counter() - start
+
+        return {
+            'processes': len(simulation.process_list),
+            'resources': len(simulation.stock),
+            'parse_s': parse_time,
+            'generation_ms': generation_time * 1000 / generations,
+            'finalize_ms': TimedWalk.finalize_time * 1000 / generations,
+            'best_score': best_walk.score,
+            'schedule': simulation.schedule_digest(best_walk),
+            'display_s': display_time,
+            'trace_lines': verifier.lines,
+            'verify_s': verify_time,
+            'verify_lines_per_s': verifier.lines / verify_time if verify_time else 0.0,
+            'verified': verified,
+        }
+
+    @staticmethod
+    def suite(args):
+        results = []
+        print(f'{"processes":>10} {"parse (s)":>10} {"walk (ms)":>10} {"final (ms)":>10} '
+              f'{"trace (s)":>10} {"lines":>8} {"verify (s)":>10} {"ok":>4}')
+        with TemporaryDirectory() as directory:
+            for process_count in args.processes:
+                parameters = {'processes': process_count, 'depth': args.depth, 'fan_in': args.fan_in,
+                              'max_delay': args.delay, 'cycles': args.cycles, 'seed': args.seed}
+                config = ConfigGenerator.generate(process_count, args.depth, args.fan_in, args.delay,
+                                                  args.cycles, seed=args.seed)
+                result = Benchmark.measure(config, args.generations, args.cycle, args.instructions, directory)
+                results.append({'parameters': parameters, **result})
+                print(f'{process_count:>10} {result["parse_s"]:>10.3f} {result["generation_ms"]:>10.2f} '
+                      f'{result["finalize_ms"]:>10.2f} {result["display_s"]:>10.3f} {result["trace_lines"]:>8} '
+                      f'{result["verify_s"]:>10.3f} {"yes" if result["verified"] else "no":>4}')
+
+        if args.json:
+            report = {'label': args.label, 'timestamp': time(), 'python': platform.python_version(),
+                      'generations': args.generations, 'max_cycle': args.cycle,
+                      'max_instructions': args.instructions, 'results': results}
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+        return results
+
+
+    @staticmethod
+    def strategies(args):
+        config = ConfigGenerator.generate(args.processes[0], args.depth, args.fan_in, args.delay,
+                                          args.cycles, seed=args.seed)
+        results = dict()
+        print(f'{"strategy":>10} {"walks":>8} {"loop":>5} {"score":>10} {"created":>8}   score over time')
+        for name, strategy_class in sorted(STRATEGIES.items()):
+            simulation = Simulation(time())
+            simulation.load_model(StringIO(config))
+            simulation.max_cycle = args.cycle
+            simulation.max_instructions = args.instructions
+            simulation.max_generations = args.generations
+            simulation.max_delay = args.time
+            simulation.checkpoints = args.checkpoints
+            strategy = strategy_class(simulation, Random(f'{args.seed}:{name}'))
+            best_walk = strategy.run()
+            results[name] = {'evaluations': strategy.evaluations, 'rank': best_walk.rank(),
+                             'history': strategy.history}
+            timeline = ' '.join(f'{elapsed:.2f}s:{score:.3g}' for elapsed, _, score in strategy.history[-4:])
+            print(f'{name:>10} {strategy.evaluations:>8} {str(best_walk.loop):>5} {best_walk.score:>10.4f} '
+                  f'{best_walk.created:>8}   {timeline}')
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump({'label': args.label, 'timestamp': time(), 'time_budget': args.time,
+                           'results': results}, file, indent=2)
+        return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('benchmark', nargs='?', choices=['suite', 'producers', 'recipes', 'strategies', 'batch'], default='suite',
+                        help='what to measure. default:suite')
+    parser.add_argument('-n', '--processes', type=int, nargs='+', default=[100, 1000, 3000],
+                        help='process counts of the synthetic configs. default:100 1000 3000')
+    parser.add_argument('-g', '--generations', type=int, default=20, help='walks per config. default:20')
+    parser.add_argument('-i', '--instructions', type=int, default=10000,
+                        help='max number of instructions per walk. default:10000')
+    parser.add_argument('-r', '--recipes', type=int, default=10000, help='recipe cache size. default:10000')
+    parser.add_argument('-b', '--batch', type=int, default=256, help='walks scored together. default:256')
+    parser.add_argument('-d', '--depth', type=int, default=4, help='recipe depth of the synthetic configs. default:4')
+    parser.add_argument('-f', '--fan-in', type=int, default=2, help='inputs per process. default:2')
+    parser.add_argument('--delay', type=int, default=10, help='max process delay. default:10')
+    parser.add_argument('--cycles', type=float, default=0.0,
+                        help='share of processes also needing a higher-layer item. default:0')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the config generator. default:0')
+    parser.add_argument('-c', '--cycle', type=float, default=10000, help='max number of cycle. default:10000')
+    parser.add_argument('-t', '--time', type=float, default=5.0,
+                        help='time budget of each strategy in seconds. default:5')
+    parser.add_argument('--checkpoints', type=int, default=32,
+                        help='scheduler snapshots kept per walk by the strategies. default:32')
+    parser.add_argument('-j', '--json', default=None, help='write the suite results to this JSON file')
+    parser.add_argument('-l', '--label', default='', help='label stored in the JSON report, e.g. a version')
+    args = parser.parse_args()
+    if args.benchmark == 'suite':
+        Benchmark.suite(args)
+    elif args.benchmark == 'strategies':
+        Benchmark.strategies(args)
+    elif args.benchmark == 'batch':
+        Benchmark.batch_evaluation(args.processes, args.generations, args.cycle, args.instructions, args.batch,
+                                   args.cycles)
+    elif args.benchmark == 'recipes':
+        Benchmark.recipes(args.processes, args.generations, args.instructions, args.recipes)
+    else:
+        Benchmark.producer_index(args.processes, args.generations, args.instructions)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH_MEMORY = 256 << 20
+
+
+class BatchEvaluator:
+    def __init__(self, initial_stock, process_list, optimization_target, max_cycle):
+        self.initial_stock = np.array(initial_stock, dtype=np.int64)
+        self.padding = len(self.initial_stock)
+        self.optimization_target = optimization_target
+        self.max_cycle = max_cycle
+        self.names = sorted(process_list, reverse=True)
+        self.columns = {name: column for column, name in enumerate(self.names)}
+        processes = [process_list[name] for name in self.names]
+        self.delays = np.array([process.delay for process in processes], dtype=np.int64)
+        self.needs = []
+        fan_out = max((len(process.result_ids) for process in processes), default=0) or 1
+        self.result_elements = np.full((len(processes), fan_out), self.padding, dtype=np.intp)
+        self.result_quantities = np.zeros((len(processes), fan_out), dtype=np.int64)
+        for column, process in enumerate(processes):
+            for index, (element, quantity) in enumerate(process.result_ids):
+                self.result_elements[column, index] = element
+                self.result_quantities[column, index] = quantity
+            needs = [(element, quantity) for element, quantity in process.need_ids if quantity]
+            self.needs.append((np.array([element for element, _ in needs], dtype=np.intp),
+                               np.array([quantity for _, quantity in needs], dtype=np.int64)))
+        fan_in = max((len(elements) for elements, _ in self.needs), default=0) or 1
+        self.need_elements = np.full((len(processes), fan_in), self.padding, dtype=np.intp)
+        self.need_quantities = np.ones((len(processes), fan_in), dtype=np.int64)
+        for column, (elements, quantities) in enumerate(self.needs):
+            self.need_elements[column, :len(elements)] = elements
+            self.need_quantities[column, :len(quantities)] = quantities
+
+    @staticmethod
+    def available():
+        return np is not None
+
+    def counts(self, instruction_dicts, used):
+        columns = {self.names[column]: index for index, column in enumerate(used)}
+        counts = np.zeros((len(instruction_dicts), len(used)), dtype=np.int64)
+        for row, instruction_dict in enumerate(instruction_dicts):
+            for name, count in instruction_dict.items():
+                if count:
+                    counts[row, columns[name]] = count
+        return counts
+
+    def ranks(self, instruction_dicts):
+        used = np.array(sorted({self.columns[name] for instruction_dict in instruction_dicts
+                                for name, count in instruction_dict.items() if count}), dtype=np.intp)
+        width = len(used) * (self.need_elements.shape[1] + 1) + self.padding + 1
+        chunk = max(1, BATCH_MEMORY // (8 * width))
+        ranks = []
+        for first in range(0, len(instruction_dicts), chunk):
+            stock, last_cycle, launched = self.simulate(self.counts(instruction_dicts[first:first + chunk], used), used)
+            below = (stock[:, :self.padding] < self.initial_stock).any(axis=1)
+            for created, cycle, first_launched, lost in zip(stock[:, self.optimization_target].tolist(),
+                                                            last_cycle.tolist(), launched.tolist(), below.tolist()):
+                ranks.append((first_launched and not lost, created / cycle if cycle else 0, created))
+        return ranks
+
+    def simulate(self, counts, used):
+        live = np.flatnonzero(counts.any(axis=0))
+        remaining = counts[:, live]
+        used = used[live]
+        delays = self.delays[used]
+        result_elements, result_quantities = self.result_elements[used], self.result_quantities[used]
+        needs = ([self.needs[column] for column in used], self.need_elements[used], self.need_quantities[used])
+
+        stock = np.empty((len(counts), self.padding + 1), dtype=np.int64)
+        stock[:, :self.padding] = self.initial_stock
+        stock[:, self.padding] = np.iinfo(np.int64).max
+        current = np.zeros(len(counts), dtype=np.int64)
+        first_launched, pending = self.launch(np.arange(len(counts)), stock, remaining, current, delays, needs)
+        next_cycle = np.empty(len(counts), dtype=np.int64)
+
+        while True:
+            running = current[pending[0]] <= self.max_cycle
+            row, end, column, count = (values[running] for values in pending)
+            if not len(row):
+                break
+            busy = np.zeros(len(counts), dtype=bool)
+            busy[row] = True
+            active = np.flatnonzero(busy)
+            next_cycle[active] = np.iinfo(np.int64).max
+            np.minimum.at(next_cycle, row, end)
+            current[active] = next_cycle[active]
+            arrived = end == current[row]
+            column_arrived = column[arrived]
+            np.add.at(stock, (row[arrived, None], result_elements[column_arrived]),
+                      count[arrived, None] * result_quantities[column_arrived])
+            _, events = self.launch(active, stock, remaining, current, delays, needs)
+            waiting = ~arrived
+            pending = [np.concatenate([values[waiting], new_values])
+                       for values, new_values in zip((row, end, column, count), events)]
+        return stock, current, first_launched
+
+    @staticmethod
+    def waves(columns, needs):
+        waves, last_wave = [], dict()
+        for column in columns:
+            elements = needs[column][0].tolist()
+            wave = max((last_wave.get(element, -1) for element in elements), default=-1) + 1
+            for element in elements:
+                last_wave[element] = wave
+            if wave == len(waves):
+                waves.append([])
+            waves[wave].append(column)
+        return waves
+
+    @staticmethod
+    def launch(rows, stock, remaining, current, delays, needs):
+        launched = np.zeros(len(rows), dtype=bool)
+        events = [[np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.int64)],
+                  [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.int64)]]
+        needs, need_elements, need_quantities = needs
+        live = np.flatnonzero(remaining[rows].any(axis=0))
+        if not len(live):
+            return launched, [np.concatenate(values) for values in events]
+        rows = rows[:, None]
+        possible = (stock[rows[:, :, None], need_elements[live]] // need_quantities[live]).min(axis=2)
+        live = live[(np.minimum(remaining[rows, live], possible) > 0).any(axis=0)]
+
+        for wave in BatchEvaluator.waves(live.tolist(), needs):
+            columns = np.array(wave, dtype=np.intp)
+            possible = (stock[rows[:, :, None], need_elements[columns]] // need_quantities[columns]).min(axis=2)
+            count = np.minimum(remaining[rows, columns], possible)
+            launching, column = np.nonzero(count)
+            if not len(launching):
+                continue
+            count = count[launching, column]
+            row, column = rows[launching, 0], columns[column]
+            np.subtract.at(stock, (row[:, None], need_elements[column]), count[:, None] * need_quantities[column])
+            remaining[row, column] -= count
+            for values, new_values in zip(events, (row, current[row] + delays[column], column, count)):
+                values.append(new_values)
+            launched[launching] = True
+        return launched, [np.concatenate(values) for values in events]
@@ -1,132 +1,345 @@
+import json
+import sys
 from argparse import ArgumentParser, FileType
 from ctypes import c_uint
-from time import time
-from collections import deque
-from random import choice, randint
+from time import perf_counter, time
+from collections import OrderedDict, deque
+from hashlib import sha256
+from heapq import heappop, heappush
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext, redirect_stdout
+from os import cpu_count
+from random import Random, SystemRandom
 from progress.bar import ChargingBar
-from tools import StockManager, ProcessInitializer, ErrorManager
+from evaluator import BatchEvaluator
+from strategies import STRATEGIES, Genetic
+from tools import StockManager, ProcessInitializer, ErrorManager, TraceFile, Profiler, GraphAnalyzer, ResultCache
+
+class RecipeBook:
+    def __init__(self, initial_stock, producers, max_entries, variants=4, max_runs=10000):
+        self.initial_stock = initial_stock
+        self.producers = producers
+        self.max_entries = max_entries
+        self.variants = variants
+        self.max_runs = max_runs
+        self.recipes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def pool(self, element, process):
+        key = (element, process.name)
+        pool = self.recipes.get(key)
+        if pool is None:
+            pool = self.recipes[key] = []
+            if len(self.recipes) > self.max_entries:
+                self.recipes.popitem(last=False)
+        else:
+            self.recipes.move_to_end(key)
+        return pool
+
+    def sample(self, element, process, rng, path=()):
+        pool = self.pool(element, process)
+        if len(pool) >= self.variants:
+            self.hits += 1
+            return rng.choice(pool)
+        self.misses += 1
+        return self.expand(process, rng, path + (element,), pool)
+
+    def expand(self, process, rng, path, pool):
+        stack = [[process, path, pool, 0, {process.name: 1}, dict(), None]]
+        recipe = None
+        while stack:
+            frame = stack[-1]
+            process, path, pool, index, runs, raw, waiting = frame
+            if waiting is not None:
+                frame[6] = None
+                if recipe is None or not self.merge(runs, raw, recipe, waiting):
+                    stack.pop()
+                    pool.append(None)
+                    recipe = None
+                    continue
+                index += 1
+
+            while index < len(process.need_ids):
+                element, quantity = process.need_ids[index]
+                producers = self.producers.get(element)
+                if not producers or element in path or (self.initial_stock[element] and rng.randint(0, 9) < 9):
+                    raw[element] = raw.get(element, 0) + quantity
+                    index += 1
+                    continue
+                producer = rng.choice(producers)
+                child_pool = self.pool(element, producer)
+                frame[3], frame[6] = index, (element, producer, quantity)
+                if len(child_pool) < self.variants:
+                    self.misses += 1
+                    stack.append([producer, path + (element,), child_pool, 0, {producer.name: 1}, dict(), None])
+                    break
+                self.hits += 1
+                recipe = rng.choice(child_pool)
+                break
+            else:
+                stack.pop()
+                recipe = tuple(runs.items()), tuple(raw.items())
+                pool.append(recipe)
+        return recipe
+
+    def merge(self, runs, raw, recipe, waiting):
+        element, producer, quantity = waiting
+        made = next(made for result, made in producer.result_ids if result == element)
+        count = -(-quantity // made) if made else 1
+        for name, runs_count in recipe[0]:
+            runs[name] = runs.get(name, 0) + runs_count * count
+        for raw_element, raw_quantity in recipe[1]:
+            raw[raw_element] = raw.get(raw_element, 0) + raw_quantity * count
+        return sum(runs.values()) <= self.max_runs
+
 
 class MainWalk:
-    def __init__(self, initial_stock, optimization_target, process_list, max_cycle, max_instructions):
+    def __init__(self, initial_stock, optimization_target, process_list, max_cycle, max_instructions,
+                 rng=None, producers=None, recipe_book=None, profiler=None, instruction_dict=None, base=None,
+                 checkpoints=0, evaluate=True):
+        self.rng = rng if rng is not None else Random()
         self.optimization_target = optimization_target
         self.process_list = process_list
+        self.producers = producers if producers is not None else ProcessInitializer.build_producer_index(process_list)
         self.max_instructions = max_instructions
-        self.current_stock = initial_stock.copy()
-        self.updated_stock = initial_stock.copy()
         self.required_stock = dict()
         self.instruction_dict = dict()
+        self.instructions = dict()
         self.good_instructions = deque()
         self.score = int()
         self.created = int()
         self.loop = True
-        self.retrieve_instructions(process_list)
-        self.finalize_process(max_cycle)
-        self.calculate_score(initial_stock)
+        self.launch_attempts = 0
+        self.launches = 0
+        self.checkpoints = [] if checkpoints else None
+        self.checkpoint_interval = 1
+        self.max_checkpoints = checkpoints
+        if profiler is None:
+            self.current_stock = initial_stock[:]
+            self.updated_stock = initial_stock[:]
+            self.build_instructions(initial_stock, recipe_book, instruction_dict)
+            if evaluate:
+                self.finalize_process(max_cycle, base)
+                self.calculate_score(initial_stock)
+        else:
+            start = perf_counter()
+            self.current_stock = initial_stock[:]
+            self.updated_stock = initial_stock[:]
+            profiler.add_time('stock copy', perf_counter() - start)
+            phase = 'retrieve_instructions' if instruction_dict is None and recipe_book is None else 'build_instructions'
+            profiler.call(phase, self.build_instructions, initial_stock, recipe_book, instruction_dict)
+            if evaluate:
+                profiler.call('finalize_process', self.finalize_process, max_cycle, base)
+                profiler.call('calculate_score', self.calculate_score, initial_stock)
+
+    def build_instructions(self, initial_stock, recipe_book, instruction_dict):
+        if instruction_dict is not None:
+            self.instruction_dict = dict(instruction_dict)
+        elif recipe_book is not None:
+            self.retrieve_from_recipes(recipe_book, initial_stock)
+        else:
+            self.retrieve_instructions(self.process_list)
+        self.instructions = dict(self.instruction_dict)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['process_list'] = None
+        state['producers'] = None
+        state['rng'] = None
+        return state
+
+    def rank(self):
+        return self.loop, self.score, self.created
 
     def calculate_score(self, initial_stock):
-        self.created = self.updated_stock.get(self.optimization_target, 0)
+        self.created = self.updated_stock[self.optimization_target]
         
         if not self.good_instructions or self.good_instructions[-1][0] == 0:
             self.score = 0
         else:
             self.score = self.created / self.good_instructions[-1][0]
 
-        if not self.good_instructions or any(self.updated_stock[key] < initial_stock[key] for key in initial_stock) or not self.good_instructions[0][1]:
+        if not self.good_instructions or any(map(int.__lt__, self.updated_stock, initial_stock)) or not self.good_instructions[0][1]:
             self.loop = False
 
-    def finalize_process(self, max_cycle):
-        current_cycle = 0
-        possible_processes = self.finalize_possible_processes(self.instruction_dict)
-        self.good_instructions = [[current_cycle, possible_processes]]
-        todo_list = self.update_process_list(current_cycle, possible_processes, {})
-
-        while todo_list and current_cycle <= max_cycle:
-            current_cycle = min(map(int, todo_list.keys()))
-            for process_name in todo_list[current_cycle]:
-                StockManager.update(self.updated_stock, self.process_list[process_name].result, '+')
-            del todo_list[current_cycle]
-            possible_processes = self.finalize_possible_processes(self.instruction_dict)
+    def finalize_process(self, max_cycle, base=None):
+        current_cycle, event_index = 0, 0
+        events, pending = [], {}
+        if base is not None and base.checkpoints:
+            current_cycle, event_index, events, pending = self.resume_from(base)
+        order = sorted((key for key, count in self.instruction_dict.items() if count), reverse=True)
+
+        if event_index == 0:
+            self.save_checkpoint(event_index, current_cycle, events, pending)
+            possible_processes = self.finalize_possible_processes(order, current_cycle, events, pending)
+            self.good_instructions = [[current_cycle, possible_processes]]
+            event_index = 1
+
+        while pending and current_cycle <= max_cycle:
+            if self.checkpoints is not None and event_index % self.checkpoint_interval == 0:
+                self.save_checkpoint(event_index, current_cycle, events, pending)
+            current_cycle = heappop(events)
+            for process, count in pending.pop(current_cycle):
+                StockManager.add(self.updated_stock, process.result_ids, count)
+            possible_processes = self.finalize_possible_processes(order, current_cycle, events, pending)
             self.good_instructions.append([current_cycle, possible_processes])
-            todo_list = self.update_process_list(current_cycle, possible_processes, todo_list)
+            event_index += 1
 
         return self.good_instructions
 
-    def finalize_possible_processes(self, instruction_dict):
+    def save_checkpoint(self, event_index, current_cycle, events, pending):
+        if self.checkpoints is None:
+            return
+        self.checkpoints.append((event_index, current_cycle, self.updated_stock[:], events[:],
+                                 {cycle: batch[:] for cycle, batch in pending.items()}, dict(self.instruction_dict)))
+        if len(self.checkpoints) > self.max_checkpoints:
+            self.checkpoints = self.checkpoints[::2]
+            self.checkpoint_interval *= 2
+
+    def divergence(self, instruction_dict):
+        changed = {name: (self.instructions.get(name, 0), instruction_dict.get(name, 0))
+                   for name in self.instructions.keys() | instruction_dict.keys()
+                   if self.instructions.get(name, 0) != instruction_dict.get(name, 0)}
+        if not changed:
+            return len(self.good_instructions)
+
+        launched = dict.fromkeys(changed, 0)
+        for event_index, (_, processes_cycle) in enumerate(self.good_instructions):
+            for process_name in processes_cycle:
+                if process_name in launched:
+                    launched[process_name] += 1
+            for process_name, (old_count, new_count) in changed.items():
+                if launched[process_name] == old_count < new_count or launched[process_name] > new_count:
+                    return event_index
+        return len(self.good_instructions)
+
+    def resume_from(self, base):
+        divergence = base.divergence(self.instruction_dict)
+        deltas = {name: self.instruction_dict.get(name, 0) - base.instructions.get(name, 0)
+                  for name in base.instructions.keys() | self.instruction_dict.keys()}
+
+        checkpoints = []
+        for event_index, current_cycle, stock, events, pending, remaining in base.checkpoints:
+            if event_index > divergence:
+                break
+            remaining = dict(remaining)
+            for name, delta in deltas.items():
+                if delta:
+                    remaining[name] = remaining.get(name, 0) + delta
+            checkpoints.append((event_index, current_cycle, stock, events, pending, remaining))
+
+        event_index, current_cycle, stock, events, pending, remaining = checkpoints.pop()
+        if self.checkpoints is not None:
+            self.checkpoints = checkpoints
+            self.checkpoint_interval = base.checkpoint_interval
+        self.updated_stock = stock[:]
+        self.instruction_dict = dict(remaining)
+        self.good_instructions = list(base.good_instructions)[:event_index]
+        return current_cycle, event_index, events[:], {cycle: batch[:] for cycle, batch in pending.items()}
+
+    def finalize_possible_processes(self, order, current_cycle, events, pending):
         processes_cycle = []
-        
-        for key in sorted(instruction_dict.keys(), reverse=True):
-            count = instruction_dict[key]
-            while count > 0 and self.finalize_process_if_possible(key):
-                processes_cycle.append(key)
-                instruction_dict[key] -= 1
-                count -= 1
-
+        exhausted = False
+        self.launch_attempts += len(order)
+
+        for key in order:
+            count = self.finalize_process_if_possible(key, self.instruction_dict[key])
+            if count:
+                self.launches += 1
+                processes_cycle.extend([key] * count)
+                self.instruction_dict[key] -= count
+                exhausted = exhausted or not self.instruction_dict[key]
+                self.update_process_list(current_cycle, key, count, events, pending)
+
+        if exhausted:
+            order[:] = [key for key in order if self.instruction_dict[key]]
         return processes_cycle
 
-    def finalize_process_if_possible(self, process_name):
-        temp_stock = self.updated_stock.copy()
-        for element, quantity in self.process_list[process_name].need.items():
-            if temp_stock[element] < quantity:
-                return False
-            temp_stock[element] -= quantity
-        self.updated_stock = temp_stock
-        return True
+    def finalize_process_if_possible(self, process_name, count):
+        return StockManager.take_up_to(self.updated_stock, self.process_list[process_name].need_ids, count)
 
-    def update_process_list(self, current_cycle, actions, todo_list):
-        for action in actions:
-            todo_list.setdefault(current_cycle + self.process_list[action].delay, []).append(action)
-        return todo_list
+    def update_process_list(self, current_cycle, process_name, count, events, pending):
+        process = self.process_list[process_name]
+        end_cycle = current_cycle + process.delay
+        if end_cycle not in pending:
+            pending[end_cycle] = []
+            heappush(events, end_cycle)
+        pending[end_cycle].append((process, count))
 
     def retrieve_instructions(self, process_list):
         self.select_process(self.optimization_target, -1, process_list)
         while self.required_stock:
-            required_name = next(iter(self.required_stock))
-            if not self.select_process(required_name, self.required_stock[required_name], process_list):
+            required_element = next(iter(self.required_stock))
+            if not self.select_process(required_element, self.required_stock[required_element], process_list):
                 break
 
-    def select_process(self, required_name, required_quantity, process_list):
-        current_stock_required = self.current_stock[required_name]
+    def retrieve_from_recipes(self, recipe_book, initial_stock):
+        possible_process_list = self.producers.get(self.optimization_target)
+        if not possible_process_list:
+            return
+        recipe = None
+        for _ in possible_process_list:
+            recipe = recipe_book.sample(self.optimization_target, self.rng.choice(possible_process_list), self.rng)
+            if recipe is not None and all(initial_stock[element] >= quantity for element, quantity in recipe[1]):
+                break
+        if recipe is None or sum(count for _, count in recipe[0]) > self.max_instructions:
+            return
+        self.instruction_dict = dict(recipe[0])
+        self.max_instructions -= sum(self.instruction_dict.values())
+
+    def select_process(self, required_element, required_quantity, process_list):
+        current_stock_required = self.current_stock[required_element]
 
-        if current_stock_required == 0 or required_quantity == -1 or randint(0, 9) >= 9 or self.max_instructions <= 0:
-            possible_process_list = self.list_possible_processes(required_name, process_list)
+        if current_stock_required == 0 or required_quantity == -1 or self.rng.randint(0, 9) >= 9 or self.max_instructions <= 0:
+            possible_process_list = self.list_possible_processes(required_element, process_list)
 
             if not possible_process_list or self.max_instructions <= 0:
                 return False
 
-            chosen_process = choice(possible_process_list)
+            chosen_process = self.rng.choice(possible_process_list)
             process_name = chosen_process.name
 
             self.instruction_dict[process_name] = self.instruction_dict.get(process_name, 0) + 1
 
-            StockManager.update(self.required_stock, chosen_process.need, '+')
-            StockManager.update(self.required_stock, chosen_process.result, '-')
+            self.require(chosen_process)
 
-            while required_name in self.required_stock and self.max_instructions > 0:
-                if self.required_stock[required_name] >= required_quantity:
+            while required_element in self.required_stock and self.max_instructions > 0:
+                if self.required_stock[required_element] >= required_quantity:
                     self.max_instructions -= 1
                     break
 
                 self.instruction_dict[process_name] += 1
-                StockManager.update(self.required_stock, chosen_process.need, '+')
-                StockManager.update(self.required_stock, chosen_process.result, '-')
+                self.require(chosen_process)
                 self.max_instructions -= 1
 
         else:
             temp_quantity = current_stock_required - required_quantity
-            self.current_stock[required_name] = 0 if temp_quantity < 0 else temp_quantity
             if temp_quantity < 0:
-                StockManager.update(self.current_stock, {required_name: temp_quantity}, '-')
+                self.current_stock[required_element] = -temp_quantity
             else:
-                del self.required_stock[required_name]
+                self.current_stock[required_element] = temp_quantity
+                del self.required_stock[required_element]
 
         return True
 
-    def list_possible_processes(self, required_name, process_list):
-        possible_process_list = list()
-        for process in process_list:
-            if required_name in process_list[process].result.keys():
-                possible_process_list.append(process_list[process])
-        return possible_process_list
+    def require(self, process):
+        required_stock = self.required_stock
+        for element, quantity in process.need_ids:
+            required_stock[element] = required_stock.get(element, 0) + quantity
+        for element, quantity in process.result_ids:
+            remaining = required_stock.get(element, 0) - quantity
+            if remaining > 0:
+                required_stock[element] = remaining
+            else:
+                required_stock.pop(element, None)
+
+    def list_possible_processes(self, required_element, process_list):
+        return self.producers.get(required_element, [])
 
     def display_process(self):
         print('\nMain walk:')
@@ -152,6 +365,45 @@ class MainWalk:
             else:
                 print(f'===> {process_name}: at cycle {cycles_str}: ({data["count"]} times)')
 
+_worker_model = None
+_worker_producers = None
+_worker_recipes = None
+_worker_profile = False
+
+def init_worker(stock, optimization_target, process_list, max_cycle, max_instructions, producers, recipe_cache,
+                profile):
+    global _worker_model, _worker_producers, _worker_recipes, _worker_profile
+    _worker_model = (stock, optimization_target, process_list, max_cycle, max_instructions)
+    _worker_producers = producers
+    _worker_recipes = RecipeBook(stock, producers, recipe_cache) if recipe_cache else None
+    _worker_profile = profile
+
+def generate_walks(seed, first_index, last_index, deadline):
+    best_index, best_walk = first_index, None
+    generated = 0
+    profiler = Profiler() if _worker_profile else None
+    hits, misses = (_worker_recipes.hits, _worker_recipes.misses) if _worker_recipes else (0, 0)
+    for index in range(first_index, last_index):
+        if index and time() > deadline:
+            break
+        new_main_walk = MainWalk(*_worker_model, rng=Random(f'{seed}:{index}'), producers=_worker_producers,
+                                 recipe_book=_worker_recipes, profiler=profiler)
+        generated += 1
+        if profiler is not None:
+            profiler.count_walk(new_main_walk)
+        if best_walk is None or new_main_walk.rank() > best_walk.rank():
+            best_index, best_walk = index, new_main_walk
+    if _worker_recipes:
+        hits, misses = _worker_recipes.hits - hits, _worker_recipes.misses - misses
+    return first_index, best_index, best_walk, generated, (hits, misses), profiler and profiler.report()
+
+class QuietBar:
+    def next(self, n=1):
+        pass
+
+    def finish(self):
+        pass
+
 class Simulation:
     def __init__(self, start_time):
         self.max_delay = float()
@@ -159,97 +411,424 @@ class Simulation:
         self.max_generations = int()
         self.max_instructions = int()
         self.stock = dict()
+        self.stock_vector = None
+        self.resources = None
+        self.target_id = int()
         self.process_list = dict()
+        self.producers = dict()
         self.optimization_target = str()
         self.good_instructions = []
+        self.last_cycle = 0
         self.start_time = start_time
         self.file_name = str()
+        self.output = str()
+        self.summary_only = False
+        self.workers = 1
+        self.seed = None
+        self.recipe_cache = 0
+        self.recipe_book = None
+        self.recipe_stats = [0, 0]
+        self.generations = 0
+        self.search_time = 0.0
+        self.profiler = None
+        self.profile_json = None
+        self.strategy = 'random'
+        self.checkpoints = 0
+        self.max_checkpoints = 32
+        self.population = 20
+        self.history = []
+        self.prune = True
+        self.prune_report = None
+        self.show_progress = sys.stderr.isatty()
+        self.config_hash = str()
+        self.result_cache = False
+        self.result_key = None
+        self.result_stored = False
+        self.warm_start = None
+        self.warm_rank = None
+        self.batch_size = 0
+        self.budget = 'time'
+        self.report = False
+        self.report_json = None
 
     def argument_parser(self):
         parser = ArgumentParser()
         parser.add_argument('file', type=FileType('r'), help='file to optimize')
         parser.add_argument('delay', type=float, help='max time to process')
+        parser.add_argument('-w', '--workers', type=int, default=1,
+                            help='number of worker processes generating walks, 0 for one per core. default:1')
+        parser.add_argument('-o', '--output', default=None,
+                            help='trace file, - for stdout, gzip compressed if ending in .gz. default:<file>.csv')
+        Simulation.add_search_arguments(parser)
+        parser.add_argument('--profile', action='store_true', help='print per-phase timers and counters')
+        parser.add_argument('--profile-json', default=None, help='also write the profile to this JSON file')
+        parser.add_argument('--report', action='store_true',
+                            help='print the seed, throughput, schedule digest and best score by generation')
+        parser.add_argument('--report-json', default=None, help='also write the report to this JSON file')
+        args = parser.parse_args()
+        if args.profile or args.profile_json:
+            self.profiler = Profiler()
+            self.profile_json = args.profile_json
+        self.file_name = args.file.name.rsplit('\\', -2)[-1]
+        self.output = args.output or f'{self.file_name}.csv{".gz" if args.gzip else ""}'
+        self.workers = args.workers if args.workers > 0 else cpu_count() or 1
+        self.report = args.report
+        self.report_json = args.report_json
+        with self.console():
+            self.configure(args)
+            if self.profiler is not None:
+                self.profiler.call('load_model', self.load_model, args.file, not args.no_cache)
+            else:
+                self.load_model(args.file, cache=not args.no_cache)
+
+    @staticmethod
+    def add_search_arguments(parser):
         parser.add_argument('-c', '--cycle', default=10000, help='max number of cycle. default:10000')
         parser.add_argument('-p', '--process', default=1000, help='max number of process. default:1000')
         parser.add_argument('-i', '--instructions', default=10000,
                             help='max number of instructions allowed during process generation. default:10000')
-        args = parser.parse_args()
-        self.file_name = args.file.name.rsplit('\\', -2)[-1]
+        parser.add_argument('-s', '--seed', type=int, default=None,
+                            help='base seed of the walk generators. default:random')
+        parser.add_argument('-z', '--gzip', action='store_true', help='gzip the default trace file into <file>.csv.gz')
+        parser.add_argument('--summary-only', action='store_true', help='print the result without writing the trace')
+        parser.add_argument('--no-cache', action='store_true', help='always parse the file, ignoring the parse cache')
+        parser.add_argument('-r', '--recipes', type=int, default=0,
+                            help='sample walks from a cache of at most this many recipes, 0 to disable. default:0')
+        parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random',
+                            help='how walks are searched: independent random walks, local search, '
+                                 'simulated annealing or a genetic population. default:random')
+        parser.add_argument('--population', type=int, default=20,
+                            help='population size of the genetic strategy. default:20')
+        parser.add_argument('--checkpoints', type=int, default=32,
+                            help='scheduler snapshots kept per walk so mutated walks resume mid-schedule, '
+                                 '0 to always simulate from cycle 0. default:32')
+        parser.add_argument('--budget', choices=['time', 'generations'], default='time',
+                            help='stop the search at the delay, or only after -p generations, ignoring the clock '
+                                 'and the stored best result so seeded runs are reproducible. default:time')
+        parser.add_argument('-b', '--batch', type=int, default=0,
+                            help='score random walks in batches of this size with NumPy, 0 to score each walk '
+                                 'alone. default:0')
+        parser.add_argument('--no-prune', action='store_true',
+                            help='search every process, even dead ones or ones useless for the target')
+        parser.add_argument('--no-result-cache', action='store_true',
+                            help='neither warm start from nor update the best result stored for this file, -c and -i')
+
+    def configure(self, args):
+        self.summary_only = args.summary_only
         self.max_cycle = float(args.cycle)
-        self.max_delay = args.delay
+        self.budget = args.budget
+        self.max_delay = args.delay if self.budget == 'time' else float('inf')
         self.max_instructions = c_uint(int(args.instructions)).value
         self.max_generations = int(args.process)
         if self.max_generations < 1:
             ErrorManager.error_type('bad_processes')
-        self.optimization_target = ProcessInitializer.read_process_file(args.file, self.stock, self.process_list)
+        self.seed = args.seed if args.seed is not None else SystemRandom().getrandbits(32)
+        self.recipe_cache = max(args.recipes, 0)
+        self.strategy = args.strategy
+        self.population = max(args.population, 2)
+        self.max_checkpoints = max(args.checkpoints, 0)
+        self.prune = not args.no_prune
+        self.result_cache = not args.no_result_cache
+        if self.workers > 1 and self.strategy != 'random':
+            print(f'Warning: -w/--workers only applies to the random strategy, {self.strategy} runs in one process')
+            self.workers = 1
+        self.batch_size = max(args.batch, 0)
+        if self.batch_size and self.strategy != 'random':
+            print(f'Warning: -b/--batch only applies to the random strategy, ignored with {self.strategy}')
+            self.batch_size = 0
+        elif self.batch_size and self.workers > 1:
+            print('Warning: -b/--batch scores walks in one process, ignored with -w/--workers')
+            self.batch_size = 0
+        elif self.batch_size and not BatchEvaluator.available():
+            print('Warning: NumPy is not installed, walks are scored one at a time')
+            self.batch_size = 0
+
+    def load_model(self, document, cache=False):
+        file_content = document.read()
+        self.config_hash = sha256(file_content.encode('utf-8')).hexdigest()
+        self.optimization_target = ProcessInitializer.read_process_file(StringIO(file_content), self.stock,
+                                                                        self.process_list, cache)
+        if self.prune:
+            self.process_list, self.prune_report = GraphAnalyzer.prune(self.stock, self.process_list,
+                                                                       self.optimization_target)
+        self.resources = ProcessInitializer.intern_resources(self.stock, self.process_list)
+        self.stock_vector = self.resources.vector(self.stock)
+        self.target_id = self.resources.ids[self.optimization_target]
+        self.producers = ProcessInitializer.build_producer_index(self.process_list)
+        if self.recipe_cache:
+            self.recipe_book = RecipeBook(self.stock_vector, self.producers, self.recipe_cache)
+        if self.result_cache:
+            self.load_result()
+
+    def load_result(self):
+        self.result_key = ResultCache.key(self.config_hash, self.max_cycle, self.max_instructions)
+        entry = ResultCache.load(self.result_key) if self.budget == 'time' else None
+        if entry is not None:
+            instructions = {name: count for name, count in entry['instructions'].items() if name in self.process_list}
+            self.warm_start = instructions or None
+            self.warm_rank = entry['rank']
 
     def execute(self):
+        search_start = time()
+        if self.strategy != 'random':
+            main_walk_instance = self.execute_strategy()
+        elif self.workers > 1:
+            main_walk_instance = self.execute_parallel()
+        elif self.batch_size:
+            main_walk_instance = self.execute_batched()
+        else:
+            main_walk_instance = self.execute_sequential()
+        if self.warm_start is not None and self.strategy == 'random':
+            warm_walk = self.new_walk(Random(f'{self.seed}:warm'), self.warm_start, counter='warm start replays')
+            if warm_walk.rank() > main_walk_instance.rank():
+                main_walk_instance = warm_walk
+        self.search_time = time() - search_start
+        if self.result_cache:
+            self.result_stored = ResultCache.save(self.result_key, main_walk_instance.instructions,
+                                                  main_walk_instance.rank())
+        return main_walk_instance
+
+    def new_walk(self, rng, instruction_dict=None, base=None, counter='generations'):
+        main_walk_instance = MainWalk(self.stock_vector, self.target_id, self.process_list, self.max_cycle,
+                                      self.max_instructions, rng, self.producers, self.recipe_book, self.profiler,
+                                      instruction_dict, base, self.checkpoints)
+        if self.profiler is not None:
+            self.profiler.count_walk(main_walk_instance, counter)
+        return main_walk_instance
+
+    def progress_bar(self):
+        if not self.show_progress:
+            return QuietBar()
+        return ChargingBar('Making process', max=self.max_generations, suffix='%(percent)d%%')
+
+    def execute_sequential(self):
         delta_time = time() - self.start_time
-        progress_bar = ChargingBar('Making process', max=self.max_generations, suffix='%(percent)d%%')
-        progress_bar.next()
-        main_walk_instance = MainWalk(self.stock, self.optimization_target,
-                                     self.process_list, self.max_cycle, self.max_instructions)
-        for _ in range(self.max_generations - 1):
+        profiler = self.profiler
+        progress_bar = self.progress_bar()
+        next_bar = progress_bar.next if profiler is None else profiler.timed('progress bar', progress_bar.next)
+        next_bar()
+        search_start = time()
+        main_walk_instance = self.new_walk(Random(f'{self.seed}:0'))
+        self.generations = 1
+        self.history.append((time() - search_start, 1, main_walk_instance.score))
+        for index in range(1, self.max_generations):
             delta_time = time() - self.start_time
             if delta_time > self.max_delay:
                 break
-            progress_bar.next()
-            new_main_walk = MainWalk(self.stock, self.optimization_target,
-                                             self.process_list, self.max_cycle, self.max_instructions)
-            if new_main_walk.loop > main_walk_instance.loop:
+            next_bar()
+            new_main_walk = self.new_walk(Random(f'{self.seed}:{index}'))
+            self.generations += 1
+            if new_main_walk.rank() > main_walk_instance.rank():
                 main_walk_instance = new_main_walk
-            elif new_main_walk.loop == main_walk_instance.loop and new_main_walk.score >= main_walk_instance.score:
-                if new_main_walk.score == main_walk_instance.score and new_main_walk.created <= main_walk_instance.created:
-                    pass
+                self.history.append((time() - search_start, self.generations, new_main_walk.score))
+        progress_bar.finish()
+        if self.recipe_book is not None:
+            self.recipe_stats = [self.recipe_book.hits, self.recipe_book.misses]
+        return main_walk_instance
+
+    def execute_batched(self):
+        profiler = self.profiler
+        evaluator = BatchEvaluator(self.stock_vector, self.process_list, self.target_id, self.max_cycle)
+        progress_bar = self.progress_bar()
+        best_index, best_rank, best_instructions = None, None, None
+        search_start = time()
+        while self.generations < self.max_generations:
+            first_index = self.generations
+            walks = []
+            for index in range(first_index, min(first_index + self.batch_size, self.max_generations)):
+                if index and time() - self.start_time > self.max_delay:
+                    break
+                walks.append(MainWalk(self.stock_vector, self.target_id, self.process_list, self.max_cycle,
+                                      self.max_instructions, Random(f'{self.seed}:{index}'), self.producers,
+                                      self.recipe_book, profiler, evaluate=False))
+            if not walks:
+                break
+            instruction_dicts = [walk.instruction_dict for walk in walks]
+            if profiler is not None:
+                ranks = profiler.call('batch evaluate', evaluator.ranks, instruction_dicts)
+                profiler.count('generations', len(walks))
+                profiler.count('instructions expanded', sum(sum(walk.instructions.values()) for walk in walks))
+            else:
+                ranks = evaluator.ranks(instruction_dicts)
+            elapsed = time() - search_start
+            for index, (walk, rank) in enumerate(zip(walks, ranks), first_index):
+                if best_rank is None or rank > best_rank:
+                    best_index, best_rank, best_instructions = index, rank, walk.instructions
+                    self.history.append((elapsed, index + 1, rank[1]))
+            self.generations += len(walks)
+            progress_bar.next(len(walks))
+        progress_bar.finish()
+        if self.recipe_book is not None:
+            self.recipe_stats = [self.recipe_book.hits, self.recipe_book.misses]
+        return MainWalk(self.stock_vector, self.target_id, self.process_list, self.max_cycle, self.max_instructions,
+                        Random(f'{self.seed}:{best_index}'), self.producers, None, profiler, best_instructions)
+
+    def execute_strategy(self):
+        progress_bar = self.progress_bar()
+        strategy_class = STRATEGIES[self.strategy]
+        options = {'population': self.population} if strategy_class is Genetic else {}
+        strategy = strategy_class(self, Random(f'{self.seed}:{self.strategy}'), progress_bar.next, **options)
+        self.checkpoints = self.max_checkpoints
+        main_walk_instance = strategy.run()
+        self.checkpoints = 0
+        progress_bar.finish()
+        self.generations = strategy.evaluations
+        self.history = strategy.history
+        return main_walk_instance
+
+    def execute_parallel(self):
+        search_start = time()
+        deadline = self.start_time + self.max_delay
+        chunk_size = max(1, self.max_generations // (self.workers * 8))
+        progress_bar = self.progress_bar()
+        results = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                 initargs=(self.stock_vector, self.target_id, self.process_list,
+                                           self.max_cycle, self.max_instructions, self.producers,
+                                           self.recipe_cache, self.profiler is not None)) as executor:
+            futures = [executor.submit(generate_walks, self.seed, first_index,
+                                       min(first_index + chunk_size, self.max_generations), deadline)
+                       for first_index in range(0, self.max_generations, chunk_size)]
+            for future in as_completed(futures):
+                first_index, best_index, best_walk, generated, recipe_stats, profile = future.result()
+                if self.profiler is not None:
+                    self.profiler.merge(profile)
+                    self.profiler.call('progress bar', progress_bar.next, generated)
                 else:
-                    main_walk_instance = new_main_walk
+                    progress_bar.next(generated)
+                self.generations += generated
+                self.recipe_stats = [total + count for total, count in zip(self.recipe_stats, recipe_stats)]
+                if best_walk is not None:
+                    results.append((first_index, best_index, best_walk, time() - search_start))
         progress_bar.finish()
+
+        main_walk_instance = None
+        for _, best_index, new_main_walk, elapsed in sorted(results, key=lambda result: result[0]):
+            if main_walk_instance is None or new_main_walk.rank() > main_walk_instance.rank():
+                main_walk_instance = new_main_walk
+                self.history.append((elapsed, best_index + 1, new_main_walk.score))
+        main_walk_instance.process_list = self.process_list
+        main_walk_instance.producers = self.producers
         return main_walk_instance
 
+    def console(self):
+        if self.output == '-' and not self.summary_only:
+            return redirect_stdout(sys.stderr)
+        return nullcontext()
+
     def display_parsing(self):
-        print(
-            (f'\nNice file ! {len(self.process_list)} processes, {len(self.stock)} stocks, '
-                f'{len([self.optimization_target])} to optimize\n'))
+        process_count = self.prune_report['processes'] if self.prune_report is not None else len(self.process_list)
+        with self.console():
+            print(
+                (f'\nNice file ! {process_count} processes, {len(self.stock)} stocks, '
+                    f'{len([self.optimization_target])} to optimize\n'))
+            if self.prune_report is not None and self.prune_report['processes'] > len(self.process_list):
+                GraphAnalyzer.display(self.prune_report)
+            if self.warm_start is not None:
+                print(f'Warm start from the stored best result, score {self.warm_rank[1]:.4f}\n')
 
     def display_result(self, main_walk_instance):
-        result = str()
         diff_stock = self.stock_difference(main_walk_instance)
-        i = 0
-        while main_walk_instance.good_instructions[0][1] \
-            and main_walk_instance.good_instructions[-1][0] * (i+1) <= self.max_cycle \
-                and self.update_stock(diff_stock):
+        i = self.repetitions(main_walk_instance, diff_stock)
+        self.update_stock(diff_stock, i)
+        end_time = time() - self.start_time
+        self.stock = self.resources.to_dict(self.stock_vector)
+        self.last_cycle = main_walk_instance.good_instructions[-1][0]*i + 1
+
+        with self.console():
+            main_walk_instance.display_process()
+            print(
+                f'\nNo more process doable at cycle {self.last_cycle}\n')
+            StockManager.print_stock(self.stock, 'Stock:')
+            print('time:', end_time, )
+            if self.result_stored:
+                print('New best result stored')
+            if self.recipe_cache:
+                self.display_recipes()
+            if self.report or self.report_json:
+                report = self.run_report(main_walk_instance)
+                if self.report:
+                    self.display_report(report)
+                if self.report_json:
+                    with open(self.report_json, 'w', encoding='utf-8') as file:
+                        json.dump(report, file, indent=2)
+
+        start = perf_counter()
+        if not self.summary_only:
+            with TraceFile.open(self.output, 'w') as file:
+                file.writelines(self.trace_lines(main_walk_instance, i))
+        if self.profiler is not None:
+            self.profiler.add_time('trace output', perf_counter() - start)
+            self.profiler.add_time('search', self.search_time)
+            with self.console():
+                print('')
+                self.profiler.display()
+            if self.profile_json:
+                self.profiler.write(self.profile_json)
+
+    def schedule_digest(self, main_walk_instance):
+        return sha256(repr(list(main_walk_instance.good_instructions)).encode('utf-8')).hexdigest()[:16]
+
+    def run_report(self, main_walk_instance):
+        return {
+            'seed': self.seed,
+            'budget': self.budget,
+            'strategy': self.strategy,
+            'generations': self.generations,
+            'search_s': self.search_time,
+            'generations_per_s': self.generations / self.search_time if self.search_time else 0.0,
+            'best': {'loop': main_walk_instance.loop, 'score': main_walk_instance.score,
+                     'created': main_walk_instance.created},
+            'schedule': self.schedule_digest(main_walk_instance),
+            'history': [{'generation': generation, 'elapsed_s': elapsed, 'score': score}
+                        for elapsed, generation, score in self.history],
+        }
+
+    def display_report(self, report):
+        print(f'\nRun: seed {report["seed"]}, {report["budget"]} budget, {report["generations"]} generations in '
+              f'{report["search_s"]:.3f}s ({report["generations_per_s"]:.0f}/s), schedule {report["schedule"]}')
+        print(f' {"generation":>10} {"score":>10} {"elapsed (s)":>12}')
+        for entry in report['history']:
+            print(f' {entry["generation"]:>10} {entry["score"]:>10.4f} {entry["elapsed_s"]:>12.3f}')
+        print('')
+
+    def display_recipes(self):
+        hits, misses = self.recipe_stats
+        rate = hits / (hits + misses) if hits + misses else 0.0
+        speed = self.generations / self.search_time if self.search_time else 0.0
+        print(f'recipes: {hits} hits, {misses} misses ({rate:.1%} hit rate), '
+              f'{self.generations} generations ({speed:.0f}/s)')
+
+    def trace_lines(self, main_walk_instance, repetitions):
+        period = main_walk_instance.good_instructions[-1][0]
+        for i in range(repetitions):
             for cycle in main_walk_instance.good_instructions:
                 for element in cycle[1]:
-                    result += f'{cycle[0] + main_walk_instance.good_instructions[-1][0]*i}:{element}\n'
-            i += 1
-            delta_time = time() - self.start_time
-            if delta_time > self.max_delay:
-                break
-        end_time = time() - self.start_time
-
-        main_walk_instance.display_process()
-        print(
-            f'\nNo more process doable at cycle {main_walk_instance.good_instructions[-1][0]*i + 1}\n')
-        StockManager.print_stock(self.stock, 'Stock:')
-        print('time:', end_time, )
-        
-        file = open(f'{self.file_name}.csv', 'w', encoding='utf-8')
-        result += f'{main_walk_instance.good_instructions[-1][0]*i + 1}:no_more_process_doable\n'
-        file.write(result)
-        file.close()
+                    yield f'{cycle[0] + period*i}:{element}\n'
+        yield f'{period*repetitions + 1}:no_more_process_doable\n'
 
     def stock_difference(self, main_walk_instance):
-        return {key: main_walk_instance.updated_stock[key] - value for key, value in self.stock.items() if main_walk_instance.updated_stock[key] - value}
-
-    def update_stock(self, diff_stock):
-        for key, value in diff_stock.items():
-            current_stock = self.stock.get(key, 0)
-            if current_stock + value < 0:
-                return False
-            self.stock[key] = current_stock + value
-        return True
+        return tuple((element, quantity - value) for element, (quantity, value)
+                     in enumerate(zip(main_walk_instance.updated_stock, self.stock_vector)) if quantity - value)
+
+    def repetitions(self, main_walk_instance, diff_stock):
+        if not main_walk_instance.good_instructions[0][1]:
+            return 0
+        period = main_walk_instance.good_instructions[-1][0]
+        limits = [self.stock_vector[element] // -value for element, value in diff_stock if value < 0]
+        if period > 0:
+            limits.append(int(self.max_cycle // period))
+        return max(min(limits), 0) if limits else 1
+
+    def update_stock(self, diff_stock, repetitions=1):
+        for element, value in diff_stock:
+            self.stock_vector[element] += value * repetitions
 
 def main():
+    if sys.argv[1:2] == ['batch']:
+        from krpsim_batch import main as batch_main
+        batch_main(sys.argv[2:])
+        exit(0)
     simulation = Simulation(time())
     simulation.argument_parser()
     simulation.display_parsing()
@@ -0,0 +1,151 @@
+import csv
+import glob
+import os
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import redirect_stdout
+from io import StringIO
+from math import ceil
+from os import cpu_count
+from time import time
+from krpsim import Simulation
+from tools import ErrorManager
+
+SUMMARY_FIELDS = ['file', 'status', 'processes', 'kept', 'stocks', 'target', 'quantity', 'loop', 'score', 'created',
+                  'last_cycle', 'generations', 'budget', 'time', 'stored', 'schedule', 'trace', 'error']
+SKIPPED_SUFFIXES = ('.csv', '.csv.gz', '.json', '.out', '.log')
+
+
+class Batch:
+    @staticmethod
+    def find_configs(patterns, summary):
+        paths = []
+        for pattern in patterns:
+            if os.path.isdir(pattern):
+                candidates = sorted(os.path.join(pattern, name) for name in os.listdir(pattern))
+            else:
+                candidates = sorted(glob.glob(pattern))
+            paths.extend(path for path in candidates
+                         if os.path.isfile(path) and not path.endswith(SKIPPED_SUFFIXES)
+                         and os.path.abspath(path) != os.path.abspath(summary))
+        return list(dict.fromkeys(paths))
+
+    @staticmethod
+    def trace_root(paths):
+        return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+
+    @staticmethod
+    def trace_path(path, args):
+        name = f'{path}.csv{".gz" if args.gzip else ""}'
+        if not args.output:
+            return name
+        return os.path.join(args.output, os.path.relpath(os.path.abspath(name), args.trace_root))
+
+    @staticmethod
+    def run_config(path, delay, args):
+        simulation = Simulation(time())
+        simulation.show_progress = False
+        result = {'file': path, 'budget': round(delay, 3), 'trace': '' if args.summary_only else Batch.trace_path(path, args)}
+        log = StringIO()
+        try:
+            with redirect_stdout(log):
+                simulation.configure(args)
+                if args.budget == 'time':
+                    simulation.max_delay = delay
+                simulation.output = result['trace']
+                if args.output and result['trace']:
+                    os.makedirs(os.path.dirname(result['trace']), exist_ok=True)
+                with open(path, encoding='utf-8') as document:
+                    simulation.load_model(document, cache=not args.no_cache)
+                main_walk_instance = simulation.execute()
+                simulation.display_result(main_walk_instance)
+        except SystemExit:
+            lines = [line for line in log.getvalue().split('\n') if line.startswith('Error')]
+            return {**result, 'status': 'error', 'trace': '', 'error': lines[-1] if lines else 'exited'}
+        except Exception as error:
+            return {**result, 'status': 'error', 'trace': '', 'error': f'{type(error).__name__}: {error}'}
+
+        return {
+            **result,
+            'status': 'ok',
+            'processes': simulation.prune_report['processes'] if simulation.prune_report else len(simulation.process_list),
+            'kept': len(simulation.process_list),
+            'stocks': len(simulation.stock),
+            'target': simulation.optimization_target,
+            'quantity': simulation.stock[simulation.optimization_target],
+            'loop': main_walk_instance.loop,
+            'score': main_walk_instance.score,
+            'created': main_walk_instance.created,
+            'last_cycle': simulation.last_cycle,
+            'generations': simulation.generations,
+            'time': round(time() - simulation.start_time, 3),
+            'stored': simulation.result_stored,
+            'schedule': simulation.schedule_digest(main_walk_instance),
+        }
+
+    @staticmethod
+    def run(paths, budget, workers, args):
+        deadline = time() + budget
+        queue = deque(paths)
+        results = dict()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            running = set()
+            while queue or running:
+                while queue and len(running) < workers:
+                    delay = max(deadline - time(), 0.0) / ceil(len(queue) / workers)
+                    running.add(executor.submit(Batch.run_config, queue.popleft(), delay, args))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results[result['file']] = result
+                    Batch.display_line(len(results), len(paths), result)
+        return [results[path] for path in paths]
+
+    @staticmethod
+    def display_line(index, total, result):
+        if result['status'] == 'ok':
+            print(f'[{index}/{total}] {result["file"]}: {result["target"]} => {result["quantity"]}, '
+                  f'last cycle {result["last_cycle"]}, {result["generations"]} generations in {result["time"]}s')
+        else:
+            print(f'[{index}/{total}] {result["file"]}: {result["error"]}')
+
+    @staticmethod
+    def write_summary(results, path):
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='krpsim batch')
+    parser.add_argument('paths', nargs='+', help='configuration files, directories or glob patterns')
+    parser.add_argument('delay', type=float, help='max time to process the whole batch')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='number of configs optimized at once, 0 for one per core. default:0')
+    parser.add_argument('-o', '--output', default=None,
+                        help='directory of the trace files, keeping the configs\' relative paths. '
+                             'default:next to each config')
+    parser.add_argument('--summary', default='krpsim_batch.csv', help='combined results file. default:krpsim_batch.csv')
+    Simulation.add_search_arguments(parser)
+    args = parser.parse_args(argv)
+
+    simulation = Simulation(time())
+    simulation.configure(args)
+    args.seed = simulation.seed
+    paths = Batch.find_configs(args.paths, args.summary)
+    if not paths:
+        ErrorManager.error_type('no_configs')
+    args.trace_root = Batch.trace_root(paths)
+    workers = min(args.workers if args.workers > 0 else cpu_count() or 1, len(paths))
+
+    start = time()
+    print(f'\n{len(paths)} files, {workers} workers, {args.delay}s, seed {args.seed}\n')
+    results = Batch.run(paths, args.delay, workers, args)
+    Batch.write_summary(results, args.summary)
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f'\n{len(results) - failed} optimized, {failed} failed in {time() - start:.3f}s, summary in {args.summary}\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,101 +1,111 @@
 from argparse import ArgumentParser, FileType
-from tools import StockManager, ProcessInitializer, ErrorManager
+from heapq import heappop, heappush
+from time import perf_counter
+from tools import StockManager, ProcessInitializer, ErrorManager, TraceFile
 
 class Verification:
     def __init__(self, file, trace):
         self.file = file
         self.trace = trace
         self.stock = dict()
+        self.stock_vector = None
+        self.resources = None
         self.initial_stock = dict()
         self.process_list = dict()
         self.optimization_target = str()
         self.cycle = 0
-        self.max_delay = 0
-        self.executed_processes = set()
+        self.lines = 0
+        self.running = 0
+        self.elapsed = 0.0
 
     def execute(self):
-        if not any(self.trace):
-            ErrorManager.error_verif(self.cycle, '', self.stock, '', 9)
-        self.trace.seek(0)
         self.optimization_target = ProcessInitializer.read_process_file(self.file, self.stock, self.process_list)
+        self.resources = ProcessInitializer.intern_resources(self.stock, self.process_list)
+        self.stock_vector = self.resources.vector(self.stock)
         self.initial_stock = self.stock.copy()
-        self.read_trace()
 
-    def read_trace(self):
-        previous_cycle = 0
-        cycle_set = set()
-        
-        for line in self.trace:
-                        
-            if not line.strip() or ':' not in line:
-                ErrorManager.error_verif(self.cycle, '', self.stock, line.strip(), 10)
+        start = perf_counter()
+        with self.trace as trace:
+            self.read_trace(trace)
+        self.elapsed = perf_counter() - start
+
+        if not self.lines:
+            self.error('', '', 9)
+        self.stock = self.resources.to_dict(self.stock_vector)
+
+    def error(self, process_name, stock_element, error_type):
+        self.stock = self.resources.to_dict(self.stock_vector)
+        ErrorManager.error_verif(self.cycle, process_name, self.stock, stock_element, error_type)
 
-            cycle, process_name = line.strip().split(':')
-            self.cycle = int(cycle)  
+    def read_trace(self, trace):
+        previous_cycle = 0
+        stock = self.stock_vector
+        events, pending = [], {}
+
+        for line in trace:
+            self.lines += 1
+            cycle, _, process_name = line.strip().partition(':')
+            if not process_name:
+                self.error('', line.strip(), 10)
+            try:
+                self.cycle = int(cycle)
+            except ValueError:
+                self.error('', line.strip(), 10)
 
             if process_name not in self.process_list and process_name != 'no_more_process_doable':
-                ErrorManager.error_verif(self.cycle, process_name, self.stock, '', 2)
-                
+                self.error(process_name, '', 2)
+
             if self.cycle < 0:
-                ErrorManager.error_verif(self.cycle, process_name, self.stock, '', 5)
-                
+                self.error(process_name, '', 5)
+
             if self.cycle < previous_cycle:
-                ErrorManager.error_verif(self.cycle, process_name, self.stock, previous_cycle, 7)
-
-            if process_name != 'no_more_process_doable' and self.executed_processes:
-                process = self.process_list[process_name]
-                previous_process = self.process_list.get(list(self.executed_processes)[-1], None)
-                
-                missing_dependencies = [dependency for dependency in process.need if self.stock.get(dependency, 0) < process.need[dependency]]
-
-                if missing_dependencies:
-                    additional_info = f'\nDependencies not satisfied for process {process_name}. Needed: {process.need}, Available: {previous_process.result}'
-                    ErrorManager.error_verif(self.cycle, process_name, self.stock, additional_info, 8)
-
-                if not any(dependency in previous_process.result for dependency in process.need):
-                    pass
-                else:
-                    if process.delay > 0:
-                        delay_cycle = self.cycle - previous_process.start_cycle
-                        if self.cycle - previous_cycle != self.max_delay:
-                            ErrorManager.error_verif(self.cycle, process_name, self.stock, '', 6)
-            else:
-                self.max_delay = max(self.max_delay, 1)
-
-            if previous_cycle is not None and self.cycle != previous_cycle:
-                self.max_delay = 0
-
-            if process_name != 'no_more_process_doable':
-                process = self.process_list[process_name]
-
-                StockManager.update(self.stock, process.need, '-')
-                StockManager.update(self.stock, process.result, '+')
-                
-                self.process_list[process_name].start_cycle = self.cycle
-                self.max_delay = max(self.max_delay, self.process_list[process_name].delay)
-                self.executed_processes.add(process_name)
-            else:
+                self.error(process_name, previous_cycle, 7)
+
+            while events and events[0] <= self.cycle:
+                for process in pending.pop(heappop(events)):
+                    StockManager.add(stock, process.result_ids)
+
+            if process_name == 'no_more_process_doable':
                 break
+
+            process = self.process_list[process_name]
+            if not StockManager.take_up_to(stock, process.need_ids, 1):
+                available = {element: stock[self.resources.ids[element]] for element in process.need}
+                additional_info = f'\nDependencies not satisfied for process {process_name}. Needed: {process.need}, Available: {available}'
+                self.error(process_name, additional_info, 8)
+
+            end_cycle = self.cycle + process.delay
+            if end_cycle not in pending:
+                pending[end_cycle] = []
+                heappush(events, end_cycle)
+            pending[end_cycle].append(process)
             previous_cycle = self.cycle
-            cycle_set.add(self.cycle)
-            cycle_set.add(self.cycle)
 
+        self.running = sum(map(len, pending.values()))
 
     def display_result(self):
         print(f'\nProgress is correct!\n')
-        
+
         StockManager.print_stock(self.initial_stock, 'Initial stock:')
         StockManager.print_stock(self.stock, 'Final stock:')
-        
-        print(f'Last cycle: {self.cycle}\n')
+
+        print(f'Last cycle: {self.cycle}')
+        print(f'Processes still running: {self.running}')
+        print(f'Verified {self.lines} lines in {self.elapsed:.3f}s '
+              f'({self.lines / self.elapsed if self.elapsed else 0:.0f} lines/s)\n')
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('file', type=FileType('r'), help='configuration file')
-    parser.add_argument('trace', type=FileType('r'), help='trace file')
+    parser.add_argument('trace', help='trace file, - for stdin, gzip compressed if ending in .gz')
     args = parser.parse_args()
 
-    verifier = Verification(args.file, args.trace)
+    try:
+        trace = TraceFile.open(args.trace)
+    except OSError as error:
+        parser.error(f"argument trace: can't open '{args.trace}': {error}")
+
+    verifier = Verification(args.file, trace)
     verifier.execute()
     verifier.display_result()
 
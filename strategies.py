@@ -0,0 +1,158 @@
+from math import exp
+from random import Random
+from time import time
+
+
+class SearchStrategy:
+    def __init__(self, simulation, rng, on_evaluation=None):
+        self.simulation = simulation
+        self.rng = rng
+        self.on_evaluation = on_evaluation
+        self.best = None
+        self.samples = []
+        self.evaluations = 0
+        self.history = []
+        self.start_time = time()
+        self.deadline = simulation.start_time + simulation.max_delay
+
+    def budget_left(self):
+        return self.evaluations < self.simulation.max_generations and time() <= self.deadline
+
+    def progress(self):
+        by_time = (time() - self.start_time) / max(self.deadline - self.start_time, 1e-9)
+        return min(1.0, max(by_time, self.evaluations / self.simulation.max_generations))
+
+    def evaluate(self, instruction_dict=None, base=None):
+        main_walk_instance = self.simulation.new_walk(Random(self.rng.getrandbits(64)), instruction_dict, base)
+        self.evaluations += 1
+        if self.on_evaluation is not None:
+            self.on_evaluation()
+        if instruction_dict is None and main_walk_instance.instructions and len(self.samples) < 256:
+            self.samples.append(main_walk_instance.instructions)
+        if self.best is None or main_walk_instance.rank() > self.best.rank():
+            self.best = main_walk_instance
+            self.history.append((time() - self.start_time, self.evaluations, main_walk_instance.score))
+        return main_walk_instance
+
+    def start(self):
+        if self.simulation.warm_start is not None:
+            return self.evaluate(self.simulation.warm_start)
+        return self.evaluate()
+
+    def mutate(self, instructions):
+        candidate = dict(instructions)
+        names = list(candidate)
+        operation = self.rng.randrange(6) if names else 2
+
+        if operation == 0:
+            candidate[self.rng.choice(names)] += 1
+        elif operation == 1:
+            name = self.rng.choice(names)
+            candidate[name] -= 1
+            if not candidate[name]:
+                del candidate[name]
+        elif operation == 2:
+            producers = self.simulation.producers
+            needs = self.simulation.process_list[self.rng.choice(names)].need_ids if names else ()
+            element = self.rng.choice(needs)[0] if needs else self.simulation.target_id
+            if element in producers:
+                name = self.rng.choice(producers[element]).name
+                candidate[name] = candidate.get(name, 0) + 1
+        elif operation == 3:
+            name = self.rng.choice(names)
+            candidate[name] = candidate[name] * 2 if self.rng.random() < 0.5 else max(1, candidate[name] // 2)
+        elif operation == 4:
+            factor = 2 if self.rng.random() < 0.5 else 0.5
+            candidate = {name: max(1, int(count * factor)) for name, count in candidate.items()}
+        elif self.samples:
+            for name, count in self.rng.choice(self.samples).items():
+                candidate[name] = candidate.get(name, 0) + count
+
+        if sum(candidate.values()) > self.simulation.max_instructions:
+            return dict(instructions)
+        return candidate
+
+    def run(self):
+        self.start()
+        while self.budget_left():
+            self.evaluate()
+        return self.best
+
+
+class Annealing(SearchStrategy):
+    def __init__(self, simulation, rng, on_evaluation=None, temperature=0.5, restarts=10):
+        super().__init__(simulation, rng, on_evaluation)
+        self.temperature = temperature
+        self.restarts = restarts
+
+    def accept(self, candidate, current):
+        if candidate.rank() >= current.rank():
+            return True
+        temperature = self.temperature * (1 - self.progress())
+        if temperature <= 0 or candidate.loop != current.loop:
+            return False
+        delta = (candidate.score - current.score) / (abs(current.score) or 1)
+        return self.rng.random() < exp(delta / temperature)
+
+    def run(self):
+        current = self.start()
+        for _ in range(self.restarts - 1):
+            if not self.budget_left():
+                break
+            new_main_walk = self.evaluate()
+            if new_main_walk.rank() > current.rank():
+                current = new_main_walk
+
+        while self.budget_left():
+            candidate = self.evaluate(self.mutate(current.instructions), current)
+            if self.accept(candidate, current):
+                current = candidate
+        return self.best
+
+
+class LocalSearch(Annealing):
+    def __init__(self, simulation, rng, on_evaluation=None):
+        super().__init__(simulation, rng, on_evaluation, temperature=0)
+
+
+class Genetic(SearchStrategy):
+    def __init__(self, simulation, rng, on_evaluation=None, population=20, tournament=3):
+        super().__init__(simulation, rng, on_evaluation)
+        self.population = population
+        self.tournament = tournament
+
+    def select(self, population):
+        return max(self.rng.sample(population, min(self.tournament, len(population))),
+                   key=lambda main_walk_instance: main_walk_instance.rank())
+
+    def crossover(self, first, second):
+        child = dict()
+        for name in dict.fromkeys([*first.instructions, *second.instructions]):
+            count = (first if self.rng.random() < 0.5 else second).instructions.get(name, 0)
+            if count:
+                child[name] = count
+        if sum(child.values()) > self.simulation.max_instructions:
+            return dict(first.instructions)
+        return child
+
+    def run(self):
+        population = [self.start()]
+        while len(population) < self.population and self.budget_left():
+            population.append(self.evaluate())
+
+        while self.budget_left():
+            offspring = [self.best]
+            while len(offspring) < len(population) and self.budget_left():
+                parent = self.select(population)
+                child = self.crossover(parent, self.select(population))
+                offspring.append(self.evaluate(self.mutate(child), parent))
+            population = offspring
+        return self.best
+
+
+STRATEGIES = {
+    'random': SearchStrategy,
+    'local': LocalSearch,
+    'anneal': Annealing,
+    'genetic': Genetic,
+}
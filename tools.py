@@ -1,4 +1,26 @@
+import os
+import pickle
 import re
+import sys
+from array import array
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+import json
+from contextlib import contextmanager, nullcontext
+from gzip import open as gzip_open
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STOCK_PATTERN = re.compile(r'^(\w+):(\d+)$')
+PROCESS_PATTERN = re.compile(r'^(\w+):(?:\(((?:\w+:\d+;?)+)\))?:(?:\(((?:\w+:\d+;?)+)\))?:(\d+)$')
+ELEMENT_PATTERN = re.compile(r'(\w+):(\d+)')
+OPTIMIZE_PATTERN = re.compile(r'^optimize:\(((?:\w+;?)+)\)$')
+PARSE_CACHE_VERSION = 1
+PARSE_CACHE_BYTES = 64 << 20
+RESULT_CACHE_BYTES = 64 << 20
 
 class StockManager:
     @staticmethod
@@ -13,6 +35,21 @@ class StockManager:
             else:
                 raise ValueError("Invalid operation. Use '+' or '-'.")
 
+    @staticmethod
+    def add(vector, pairs, count=1):
+        for element, quantity in pairs:
+            vector[element] += quantity * count
+
+    @staticmethod
+    def take_up_to(vector, pairs, count):
+        for element, quantity in pairs:
+            if quantity and vector[element] < quantity * count:
+                count = vector[element] // quantity
+        if count:
+            for element, quantity in pairs:
+                vector[element] -= quantity * count
+        return count
+
     @staticmethod
     def print_stock(stock, msg):
         print(msg)
@@ -21,36 +58,363 @@ class StockManager:
         print('')
 
 
+class Profiler:
+    def __init__(self):
+        self.timers = dict()
+        self.counters = dict()
+
+    def call(self, phase, function, *args):
+        start = perf_counter()
+        result = function(*args)
+        self.add_time(phase, perf_counter() - start)
+        return result
+
+    def timed(self, phase, function):
+        return lambda *args: self.call(phase, function, *args)
+
+    def add_time(self, phase, seconds, calls=1):
+        timer = self.timers.setdefault(phase, [0, 0.0])
+        timer[0] += calls
+        timer[1] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_walk(self, main_walk, counter='generations'):
+        self.count(counter)
+        self.count('instructions expanded', sum(main_walk.instructions.values()))
+        self.count('launch attempts', main_walk.launch_attempts)
+        self.count('launch successes', main_walk.launches)
+        self.count('processes launched', sum(len(cycle[1]) for cycle in main_walk.good_instructions))
+        self.count('events processed', len(main_walk.good_instructions) - 1)
+
+    def merge(self, report):
+        for phase, (calls, seconds) in report['timers'].items():
+            self.add_time(phase, seconds, calls)
+        for name, value in report['counters'].items():
+            self.count(name, value)
+
+    def report(self):
+        return {'timers': self.timers, 'counters': self.counters}
+
+    def display(self):
+        print('Profile:')
+        print(f' {"phase":<24} {"calls":>10} {"total (s)":>10} {"mean (ms)":>10}')
+        for phase, (calls, seconds) in sorted(self.timers.items(), key=lambda timer: -timer[1][1]):
+            print(f' {phase:<24} {calls:>10} {seconds:>10.3f} {seconds * 1000 / calls if calls else 0:>10.3f}')
+        for name, value in self.counters.items():
+            print(f' {name:<24} {value:>10}')
+        print('')
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class ResourceIndex:
+    def __init__(self, stock):
+        self.names = list(stock)
+        self.ids = {name: index for index, name in enumerate(self.names)}
+
+    def vector(self, stock):
+        return array('q', (stock.get(name, 0) for name in self.names))
+
+    def pairs(self, elements):
+        return tuple((self.ids[name], quantity) for name, quantity in elements.items())
+
+    def to_dict(self, vector):
+        return dict(zip(self.names, vector))
+
+
+class TraceFile:
+    @staticmethod
+    def open(path, mode='r'):
+        if path == '-':
+            return nullcontext(sys.stdout if mode == 'w' else sys.stdin)
+        if path.endswith('.gz'):
+            return gzip_open(path, mode + 't', encoding='utf-8')
+        return open(path, mode, encoding='utf-8', buffering=1 << 20)
+
+
 class ProcessInitializer:
     @staticmethod
     def initialize_stock(initial_values, stock):
-        stock.update({key: stock.get(key, 0) for key in initial_values.keys()})
+        for key in initial_values:
+            stock.setdefault(key, 0)
 
             
     @staticmethod
-    def read_process_file(document, stock, process_list):
-        optimization_target = str()
+    def intern_resources(stock, process_list):
+        resources = ResourceIndex(stock)
+        for process in process_list.values():
+            process.need_ids = resources.pairs(process.need)
+            process.result_ids = resources.pairs(process.result)
+        return resources
+
+    @staticmethod
+    def build_producer_index(process_list):
+        producers = dict()
+        for process in process_list.values():
+            for element, _ in process.result_ids:
+                producers.setdefault(element, []).append(process)
+        return producers
+
+    @staticmethod
+    def read_process_file(document, stock, process_list, cache=False):
         file_content = document.read()
-        file_content = re.sub(r'#.*', '', file_content)
+        if cache:
+            key = sha256(f'{PARSE_CACHE_VERSION}:{file_content}'.encode('utf-8')).hexdigest()
+            cached = DiskCache.load('parse', key)
+            if cached is not None:
+                cached_stock, cached_processes, optimization_target = cached
+                stock.update(cached_stock)
+                process_list.update(cached_processes)
+                return optimization_target
 
-        for line in file_content.split('\n'):
-            if line and line != '\n':
-                if re.match(r'^\w+:\d+$', line):
-                    name, value = line.split(':')
-                    stock[name] = int(value)
-                elif re.match(r'^\w+:(\((\w+:\d+;?)+\))?:(\((\w+:\d+;?)+\))?:\d+$', line):
-                    process = CustomProcess(line)
-                    process_list[process.name] = process
-                    ProcessInitializer.initialize_stock(process.need, stock)
-                    ProcessInitializer.initialize_stock(process.result, stock)
-                elif re.match(r'^optimize:\((\w+;?)+\)$', line):
-                    optimization_target = re.findall(r'\w+\)$', line)[0][:-1]
+        optimization_target = ProcessInitializer.parse_content(file_content, stock, process_list)
 
         if optimization_target not in stock:
-            ErrorManager.show_error('bad_file')
+            ErrorManager.error_type('bad_file')
 
+        if cache:
+            DiskCache.save('parse', key, (stock, process_list, optimization_target))
+            DiskCache.evict('parse', PARSE_CACHE_BYTES)
         return optimization_target
 
+    @staticmethod
+    def parse_content(file_content, stock, process_list):
+        optimization_target = str()
+
+        for line in file_content.split('\n'):
+            line = line.partition('#')[0]
+            if not line:
+                continue
+            match = STOCK_PATTERN.match(line)
+            if match:
+                stock[match.group(1)] = int(match.group(2))
+                continue
+            match = PROCESS_PATTERN.match(line)
+            if match:
+                process = CustomProcess(line, match)
+                process_list[process.name] = process
+                ProcessInitializer.initialize_stock(process.need, stock)
+                ProcessInitializer.initialize_stock(process.result, stock)
+                continue
+            match = OPTIMIZE_PATTERN.match(line)
+            if match:
+                optimization_target = match.group(1).split(';')[-1]
+
+        return optimization_target
+
+
+class GraphAnalyzer:
+    @staticmethod
+    def producible(stock, process_list):
+        available = {element for element, quantity in stock.items() if quantity > 0}
+        missing, waiting, ready = dict(), dict(), list()
+        for process in process_list.values():
+            needs = [element for element, quantity in process.need.items() if quantity > 0 and element not in available]
+            missing[process.name] = len(needs)
+            for element in needs:
+                waiting.setdefault(element, []).append(process)
+            if not needs:
+                ready.append(process)
+
+        live = set()
+        while ready:
+            process = ready.pop()
+            live.add(process.name)
+            for element in process.result:
+                if element in available:
+                    continue
+                available.add(element)
+                for waiting_process in waiting.pop(element, ()):
+                    missing[waiting_process.name] -= 1
+                    if not missing[waiting_process.name]:
+                        ready.append(waiting_process)
+        return available, live
+
+    @staticmethod
+    def strongly_connected(graph):
+        index, low, stack, on_stack, components = dict(), dict(), list(), set(), list()
+        for root in graph:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(graph[root]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(graph[child])))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            element = stack.pop()
+                            on_stack.discard(element)
+                            component.append(element)
+                            if element == node:
+                                break
+                        components.append(component)
+        return components
+
+    @staticmethod
+    def prune(stock, process_list, optimization_target):
+        available, live = GraphAnalyzer.producible(stock, process_list)
+
+        graph = {optimization_target: set()}
+        for name in live:
+            process = process_list[name]
+            for element in process.need:
+                graph.setdefault(element, set()).update(process.result)
+            for element in process.result:
+                graph.setdefault(element, set())
+        components = GraphAnalyzer.strongly_connected(graph)
+
+        component_of = {element: number for number, component in enumerate(components) for element in component}
+        feeders = dict()
+        for element, results in graph.items():
+            for result in results:
+                if component_of[result] != component_of[element]:
+                    feeders.setdefault(component_of[result], set()).add(component_of[element])
+        relevant_components = {component_of[optimization_target]}
+        queue = [component_of[optimization_target]]
+        while queue:
+            for number in feeders.get(queue.pop(), ()):
+                if number not in relevant_components:
+                    relevant_components.add(number)
+                    queue.append(number)
+        relevant = {element for number in relevant_components for element in components[number]}
+
+        pruned = {name: process for name, process in process_list.items()
+                  if name in live and any(element in relevant for element in process.result)}
+        cycles = [sorted(component) for component in components if len(component) > 1 or component[0] in graph[component[0]]]
+        report = {
+            'processes': len(process_list),
+            'dead': sorted(name for name in process_list if name not in live),
+            'useless': sorted(name for name in live if name not in pruned),
+            'unreachable': sorted(element for element in stock if element not in available),
+            'cycles': cycles,
+            'target_producible': optimization_target in available,
+        }
+        return pruned, report
+
+    @staticmethod
+    def display(report):
+        removed = len(report['dead']) + len(report['useless'])
+        print(f'Pruned {removed} of {report["processes"]} processes before search')
+        for label, names in (('dead', report['dead']), ('useless', report['useless']),
+                             ('unreachable stocks', report['unreachable'])):
+            if names:
+                shown = ', '.join(names[:10]) + (f' and {len(names) - 10} more' if len(names) > 10 else '')
+                print(f' {label} ({len(names)}): {shown}')
+        if report['cycles']:
+            sizes = sorted((len(cycle) for cycle in report['cycles']), reverse=True)
+            print(f' cycles collapsed: {len(sizes)}, largest {sizes[0]} stocks')
+        if not report['target_producible']:
+            print(' the optimization target can never be produced')
+        print('')
+
+
+class DiskCache:
+    @staticmethod
+    def directory(kind):
+        root = os.environ.get('KRPSIM_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'krpsim')
+        return os.path.join(root, kind)
+
+    @staticmethod
+    def path(kind, key):
+        return os.path.join(DiskCache.directory(kind), f'{key}.pickle')
+
+    @staticmethod
+    def load(kind, key):
+        try:
+            with open(DiskCache.path(kind, key), 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        try:
+            os.utime(DiskCache.path(kind, key))
+        except OSError:
+            pass
+        return value
+
+    @staticmethod
+    def save(kind, key, value):
+        directory = DiskCache.directory(kind)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with NamedTemporaryFile('wb', dir=directory, delete=False) as file:
+                pickle.dump(value, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(file.name, DiskCache.path(kind, key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def evict(kind, max_bytes):
+        entries = []
+        try:
+            for entry in os.scandir(DiskCache.directory(kind)):
+                if entry.name.endswith('.pickle'):
+                    status = entry.stat()
+                    entries.append((status.st_mtime, status.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ResultCache:
+    @staticmethod
+    def key(config_hash, max_cycle, max_instructions):
+        return sha256(f'{config_hash}:{max_cycle}:{max_instructions}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    @contextmanager
+    def locked():
+        directory = DiskCache.directory('results')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'a') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            yield directory
+
+    @staticmethod
+    def load(key):
+        return DiskCache.load('results', key)
+
+    @staticmethod
+    def save(key, instructions, rank, max_bytes=RESULT_CACHE_BYTES):
+        try:
+            with ResultCache.locked():
+                stored = DiskCache.load('results', key)
+                if stored is not None and stored['rank'] >= rank:
+                    return False
+                DiskCache.save('results', key, {'instructions': instructions, 'rank': rank})
+                DiskCache.evict('results', max_bytes)
+                return True
+        except OSError:
+            return False
+
 
 class ErrorManager:
     @staticmethod
@@ -78,28 +442,34 @@ class ErrorManager:
     def error_type(error):
         error_messages = {
             'bad_file': 'Bad file',
-            'bad_processes': 'No processes in the folder!!!\nMinimum one process is required'
+            'bad_processes': 'No processes in the folder!!!\nMinimum one process is required',
+            'no_configs': 'No configuration file found'
         }
         print(f'Error: {error_messages[error]}')
         exit(1)
         
         
 class CustomProcess:
-    def __init__(self, line):
+    def __init__(self, line, match=None):
         self.name = str()
         self.need = dict()
         self.result = dict()
         self.delay = int()
-        self.extract_info(line)
+        self.need_ids = tuple()
+        self.result_ids = tuple()
+        self.extract_info(line, match)
         self.start_cycle = None
 
-    def extract_info(self, line):
-        self.name = line.split(':')[0]
-
-        match_info = re.match(r'\w+:\(([^)]+)\):\(([^)]+)\):(\d+)$', line)
+    def extract_info(self, line, match=None):
+        match_info = match or PROCESS_PATTERN.match(line)
         if match_info:
-            need_info, result_info, delay = match_info.groups()
-
-            self.need = {key: int(value) for element in need_info.split(';') for key, value in (element.split(':'),)}
-            self.result = {key: int(value) for element in result_info.split(';') for key, value in (element.split(':'),)}
+            self.name, need_info, result_info, delay = match_info.groups()
+            self.need = CustomProcess.parse_elements(need_info)
+            self.result = CustomProcess.parse_elements(result_info)
             self.delay = int(delay)
+        else:
+            self.name = line.split(':')[0]
+
+    @staticmethod
+    def parse_elements(info):
+        return {sys.intern(key): int(value) for key, value in ELEMENT_PATTERN.findall(info)} if info else dict()